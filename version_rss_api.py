@@ -1,19 +1,39 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 import abc
+import concurrent.futures
+import functools
 import re
-from typing import Optional
+import threading
+import time
+from typing import Dict, Iterator, List, Optional
 
-import atoma
+import orjson
 import requests
 import packaging.version
 import requests.adapters
-from flask import Flask, jsonify
+from flask import Flask, Response, request
+from urllib3.util.retry import Retry
 
 __service__ = 'RSS Version Checker'
 __version__ = '0.1.0'
 
 
+_SEMVER_RE = re.compile(r'\d{1,4}\.\d{1,4}\.\d{1,4}')
+_parse_version = functools.lru_cache(maxsize=4096)(packaging.version.parse)
+
+
+def _try_parse_version(version: str):
+    try:
+        return _parse_version(version)
+    except packaging.version.InvalidVersion:
+        return None
+
+# maps URL to (etag, last_modified, version) so unchanged upstream responses can be answered from cache
+_CONDITIONAL_CACHE = {}
+_CONDITIONAL_CACHE_LOCK = threading.Lock()
+
+
 class FixedTimeoutAdapter(requests.adapters.HTTPAdapter):
     def send(self, *pargs, **kwargs):
         if kwargs['timeout'] is None:
@@ -21,13 +41,22 @@ class FixedTimeoutAdapter(requests.adapters.HTTPAdapter):
         return super(FixedTimeoutAdapter, self).send(*pargs, **kwargs)
 
 
+# one adapter shared by all sessions so they draw from the same connection pool
+_ADAPTER = FixedTimeoutAdapter(
+    pool_connections=8,
+    pool_maxsize=32,
+    max_retries=Retry(total=2, backoff_factor=0.3),
+)
+
+
 class VersionPlugin(abc.ABC):
-    def __init__(self, user_agent: str):
-        self.session = requests.session()
-        self.session.mount('https://', FixedTimeoutAdapter())
-        self.session.mount('http://', FixedTimeoutAdapter())
-        self.session.headers = {'User-Agent': user_agent}
-        self.semver_regex = re.compile(r'\d{1,4}\.\d{1,4}\.\d{1,4}')
+    def __init__(self, user_agent: str, session: Optional[requests.Session] = None):
+        if session is None:
+            session = requests.session()
+            session.mount('https://', _ADAPTER)
+            session.mount('http://', _ADAPTER)
+            session.headers = {'User-Agent': user_agent, 'Accept-Encoding': 'gzip, deflate'}
+        self.session = session
 
     def __call__(self) -> Optional[str]:
         raise NotImplementedError()
@@ -36,6 +65,31 @@ class VersionPlugin(abc.ABC):
     def software_name(self):
         raise NotImplementedError()
 
+    def _conditional_get(self, url: str) -> requests.Response:
+        headers = {}
+        with _CONDITIONAL_CACHE_LOCK:
+            cached = _CONDITIONAL_CACHE.get(url)
+        if cached:
+            etag, last_modified, _ = cached
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+        return self.session.get(url, headers=headers)
+
+    def _cached_version(self, url: str) -> Optional[str]:
+        with _CONDITIONAL_CACHE_LOCK:
+            cached = _CONDITIONAL_CACHE.get(url)
+        return cached[2] if cached else None
+
+    def _remember_version(self, url: str, response: requests.Response, version: Optional[str]) -> None:
+        with _CONDITIONAL_CACHE_LOCK:
+            _CONDITIONAL_CACHE[url] = (
+                response.headers.get('ETag'),
+                response.headers.get('Last-Modified'),
+                version,
+            )
+
 
 class WordpressPlugin(VersionPlugin):
     @property
@@ -43,38 +97,53 @@ class WordpressPlugin(VersionPlugin):
         return 'wordpress'
 
     def __call__(self) -> Optional[str]:
-        response = self.session.get('https://api.wordpress.org/core/stable-check/1.0/')
+        url = 'https://api.wordpress.org/core/stable-check/1.0/'
+        response = self._conditional_get(url)
+        if response.status_code == requests.codes.not_modified:
+            return self._cached_version(url)
         response.raise_for_status()
         for version, status in response.json().items():
             if status == 'latest':
+                self._remember_version(url, response, version)
                 return version
 
 
 class GithubReleases(VersionPlugin, abc.ABC):
     VERSION_BLOCKLIST = ['beta', 'rc']
+    VERSION_BLOCKLIST_RE = re.compile('|'.join(re.escape(block) for block in VERSION_BLOCKLIST), re.IGNORECASE)
+    user: Optional[str] = None
+    repo: Optional[str] = None
+    URL: Optional[str] = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if cls.user and cls.repo:
+            cls.URL = F'https://api.github.com/repos/{cls.user}/{cls.repo}/releases?per_page=10'
 
     def __call__(self) -> Optional[str]:
-        response = self.session.get(F'https://github.com/{self.user}/{self.repo}/releases.atom')
+        response = self._conditional_get(self.URL)
+        if response.status_code == requests.codes.not_modified:
+            return self._cached_version(self.URL)
         response.raise_for_status()
-        feed = atoma.parse_atom_bytes(response.content)
-        versions = []
-        for entry in feed.entries:
-            title = entry.title.value
-            if any(block in title.lower() for block in self.VERSION_BLOCKLIST):
+        most_recent_version = self._most_recent_version(self._stable_versions(response.json()))
+        self._remember_version(self.URL, response, most_recent_version)
+        return most_recent_version
+
+    def _most_recent_version(self, versions: Iterator[str]) -> Optional[str]:
+        parsed = (_try_parse_version(version) for version in versions)
+        best = max((version for version in parsed if version is not None), default=None)
+        return str(best) if best is not None else None
+
+    def _stable_versions(self, entries: List[dict]) -> Iterator[str]:
+        for entry in entries:
+            if entry.get('prerelease'):
+                continue
+            title = entry.get('name') or entry.get('tag_name') or ''
+            if self.VERSION_BLOCKLIST_RE.search(title):
                 continue
             version = self.version_from_title(title)
             if version:
-                versions.append(packaging.version.parse(version))
-
-        return str(max(versions)) if len(versions) > 0 else None
-
-    @property
-    def user(self) -> str:
-        raise NotImplementedError
-
-    @property
-    def repo(self) -> str:
-        raise NotImplementedError
+                yield version
 
     def version_from_title(self, title: str) -> str:
         raise NotImplementedError
@@ -83,21 +152,22 @@ class GithubReleases(VersionPlugin, abc.ABC):
 class GithubReleasesWithVPrefixAndSemVer(GithubReleases, abc.ABC):
     def version_from_title(self, title: str) -> Optional[str]:
         title = title.strip('v')
-        if self.semver_regex.match(title):
+        if _SEMVER_RE.fullmatch(title):
             return title
 
+    def _most_recent_version(self, versions: Iterator[str]) -> Optional[str]:
+        # version_from_title only lets MAJOR.MINOR.PATCH through, so plain integer
+        # tuples compare correctly and the full packaging machinery can be skipped
+        best = max((tuple(int(part) for part in version.split('.')) for version in versions), default=None)
+        return '.'.join(str(part) for part in best) if best is not None else None
 
-class SignalCliPlugin(GithubReleases):
-    @property
-    def software_name(self):
-        return 'signal-cli'
 
-    @property
-    def user(self) -> str:
-        return 'AsamK'
+class SignalCliPlugin(GithubReleases):
+    user = 'AsamK'
+    repo = 'signal-cli'
 
     @property
-    def repo(self) -> str:
+    def software_name(self):
         return 'signal-cli'
 
     def version_from_title(self, title: str) -> Optional[str]:
@@ -106,62 +176,42 @@ class SignalCliPlugin(GithubReleases):
 
 
 class NextCloudPlugin(GithubReleasesWithVPrefixAndSemVer):
-    @property
-    def software_name(self):
-        return 'nextcloud'
+    user = 'nextcloud'
+    repo = 'server'
 
     @property
-    def user(self) -> str:
+    def software_name(self):
         return 'nextcloud'
 
-    @property
-    def repo(self) -> str:
-        return 'server'
-
 
 class RoundcubePlugin(GithubReleases):
-    @property
-    def software_name(self):
-        return 'roundcube'
+    user = 'roundcube'
+    repo = 'roundcubemail'
 
     @property
-    def user(self) -> str:
+    def software_name(self):
         return 'roundcube'
 
-    @property
-    def repo(self) -> str:
-        return 'roundcubemail'
-
     def version_from_title(self, title: str) -> Optional[str]:
         if title.startswith('Roundcube Webmail '):
             return title[18:]
 
 
 class RainloopPlugin(GithubReleasesWithVPrefixAndSemVer):
+    user = 'RainLoop'
+    repo = 'rainloop-webmail'
+
     @property
     def software_name(self):
         return 'rainloop'
 
-    @property
-    def user(self) -> str:
-        return 'RainLoop'
-
-    @property
-    def repo(self) -> str:
-        return 'rainloop-webmail'
-
 
 class DolibarrPlugin(GithubReleases):
-    @property
-    def software_name(self):
-        return 'dolibarr'
-
-    @property
-    def user(self) -> str:
-        return 'Dolibarr'
+    user = 'Dolibarr'
+    repo = 'dolibarr'
 
     @property
-    def repo(self) -> str:
+    def software_name(self):
         return 'dolibarr'
 
     def version_from_title(self, title: str) -> Optional[str]:
@@ -169,16 +219,11 @@ class DolibarrPlugin(GithubReleases):
 
 
 class HumhubPlugin(GithubReleases):
-    @property
-    def software_name(self):
-        return 'humhub'
-
-    @property
-    def user(self) -> str:
-        return 'humhub'
+    user = 'humhub'
+    repo = 'humhub'
 
     @property
-    def repo(self) -> str:
+    def software_name(self):
         return 'humhub'
 
     def version_from_title(self, title: str) -> Optional[str]:
@@ -186,68 +231,48 @@ class HumhubPlugin(GithubReleases):
 
 
 class FroxlorPlugin(GithubReleases):
+    user = 'Froxlor'
+    repo = 'Froxlor'
+
     @property
     def software_name(self):
         return 'froxlor'
 
-    @property
-    def user(self) -> str:
-        return 'Froxlor'
-
-    @property
-    def repo(self) -> str:
-        return 'Froxlor'
-
     def version_from_title(self, title: str) -> Optional[str]:
         if title.startswith('Froxlor '):
             return title.split(' ')[1]
 
 
 class CyberchefPlugin(GithubReleasesWithVPrefixAndSemVer):
+    user = 'gchq'
+    repo = 'CyberChef'
+
     @property
     def software_name(self):
         return 'cyberchef'
 
-    @property
-    def user(self) -> str:
-        return 'gchq'
-
-    @property
-    def repo(self) -> str:
-        return 'CyberChef'
-
 
 class ArangoDBPlugin(GithubReleasesWithVPrefixAndSemVer):
+    user = 'arangodb'
+    repo = 'ArangoDB'
+
     @property
     def software_name(self):
         return 'arangodb'
 
-    @property
-    def user(self) -> str:
-        return 'arangodb'
-
-    @property
-    def repo(self) -> str:
-        return 'ArangoDB'
-
 
 class GhidraPlugin(GithubReleases):
-    def __init__(self, user_agent: str):
-        super().__init__(user_agent)
+    user = 'NationalSecurityAgency'
+    repo = 'ghidra'
+
+    def __init__(self, user_agent: str, session: Optional[requests.Session] = None):
+        super().__init__(user_agent, session)
         self.r = re.compile(r'Ghidra_(?P<version>\d{1,2}\.\d{1,2}\.\d{1,2})_build')
 
     @property
     def software_name(self):
         return 'Ghidra'
 
-    @property
-    def user(self) -> str:
-        return 'NationalSecurityAgency'
-
-    @property
-    def repo(self) -> str:
-        return 'ghidra'
-
     def version_from_title(self, title: str) -> str:
         m = self.r.match(title)
         if m:
@@ -255,22 +280,17 @@ class GhidraPlugin(GithubReleases):
 
 
 class YaraPlugin(GithubReleases):
-    def __init__(self, user_agent: str):
-        super().__init__(user_agent)
+    user = 'VirusTotal'
+    repo = 'yara'
+
+    def __init__(self, user_agent: str, session: Optional[requests.Session] = None):
+        super().__init__(user_agent, session)
         self.r = re.compile(r'YARA v(?P<version>\d{1,2}\.\d{1,2}\.\d{1,2})')
 
     @property
     def software_name(self):
         return 'YARA'
 
-    @property
-    def user(self) -> str:
-        return 'VirusTotal'
-
-    @property
-    def repo(self) -> str:
-        return 'yara'
-
     def version_from_title(self, title: str) -> str:
         m = self.r.match(title)
         if m:
@@ -280,21 +300,67 @@ class YaraPlugin(GithubReleases):
 app = Flask(__name__)
 USER_AGENT = F'{__service__}/{__version__}'
 
+_SESSION = requests.Session()
+_SESSION.mount('https://', _ADAPTER)
+_SESSION.mount('http://', _ADAPTER)
+_SESSION.headers = {'User-Agent': USER_AGENT, 'Accept-Encoding': 'gzip, deflate'}
+
+PLUGINS = [cls(USER_AGENT, _SESSION) for cls in [
+    WordpressPlugin,
+    SignalCliPlugin,
+    NextCloudPlugin,
+    RoundcubePlugin,
+    DolibarrPlugin,
+    HumhubPlugin,
+    FroxlorPlugin,
+    RainloopPlugin,
+    CyberchefPlugin,
+    ArangoDBPlugin,
+    GhidraPlugin,
+    YaraPlugin,
+]]
+
+# resolves the software_name properties once so per-request work is plain dict iteration
+PLUGIN_INSTANCES: Dict[str, VersionPlugin] = dict((plugin.software_name, plugin) for plugin in PLUGINS)
+
+EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=len(PLUGIN_INSTANCES))
+
+
+def _call_plugin(plugin: VersionPlugin) -> Optional[str]:
+    try:
+        return plugin()
+    except Exception:
+        app.logger.exception(F'Plugin for {plugin.software_name} failed')
+        return None
+
+
+# memoizes the aggregated version dict; upstream release cadences are on the order of days
+_RESPONSE_CACHE = {'timestamp': 0.0, 'data': None}
+_RESPONSE_CACHE_TTL = 300
+_RESPONSE_CACHE_LOCK = threading.Lock()
+
+
+def _cacheable_response(data: dict):
+    response = Response(orjson.dumps(data), mimetype='application/json')
+    response.cache_control.max_age = _RESPONSE_CACHE_TTL
+    response.add_etag()
+    return response.make_conditional(request)
+
 
 @app.route('/v1/most_recent', methods=['GET'])
 def most_recent():
-    plugins = [cls(USER_AGENT) for cls in [
-        WordpressPlugin,
-        SignalCliPlugin,
-        NextCloudPlugin,
-        RoundcubePlugin,
-        DolibarrPlugin,
-        HumhubPlugin,
-        FroxlorPlugin,
-        RainloopPlugin,
-        CyberchefPlugin,
-        ArangoDBPlugin,
-        GhidraPlugin,
-        YaraPlugin,
-    ]]
-    return jsonify(dict((pluign.software_name, pluign()) for pluign in plugins))
+    with _RESPONSE_CACHE_LOCK:
+        if _RESPONSE_CACHE['data'] is not None \
+                and time.monotonic() - _RESPONSE_CACHE['timestamp'] < _RESPONSE_CACHE_TTL:
+            return _cacheable_response(_RESPONSE_CACHE['data'])
+
+    futures = dict(
+        (software_name, EXECUTOR.submit(_call_plugin, plugin))
+        for software_name, plugin in PLUGIN_INSTANCES.items()
+    )
+    data = dict((software_name, future.result()) for software_name, future in futures.items())
+
+    with _RESPONSE_CACHE_LOCK:
+        _RESPONSE_CACHE['timestamp'] = time.monotonic()
+        _RESPONSE_CACHE['data'] = data
+    return _cacheable_response(data)
@@ -4,13 +4,15 @@ Script to integrate the API shipped with this repository with Zabbix. See the fo
 
 https://blag.nullteilerfrei.de/2021/03/25/zabbix-use-low-level-discovery-for-software-update-notifications/
 """
-import json
 import os
+import socket
+import struct
 import subprocess
 import logging
 import re
-from typing import List
+from typing import List, Optional, Tuple
 
+import orjson
 import requests
 
 
@@ -19,17 +21,17 @@ class ZabbixSenderException(Exception):
 
 
 class ZabbixSender(object):
+    r_processed = re.compile(r'processed: (\d+);')
+    r_failed = re.compile(r'failed: (\d+);')
+    r_total = re.compile(r'total: (\d+);')
+
     def __init__(self, logger: logging.Logger, sender_path: str, config_path: str):
         self.logger = logger
         self.sender_path = sender_path
         self.config_path = config_path
-
-        self.r_processed = re.compile(r'processed: (\d+);')
-        self.r_failed = re.compile(r'failed: (\d+);')
-        self.r_total = re.compile(r'total: (\d+);')
         self.last_command = None
 
-    def _execute_sender(self, arguments: List[str], verbose: bool = False) -> str:
+    def _execute_sender(self, arguments: List[str], verbose: bool = False, input_data: Optional[bytes] = None) -> str:
         self.last_command = [self.sender_path]
         if verbose:
             self.last_command.append('-vv')
@@ -38,10 +40,11 @@ class ZabbixSender(object):
         self.logger.debug(F'Executing: {" ".join(self.last_command)}')
         p = subprocess.Popen(
             self.last_command,
+            stdin=subprocess.PIPE if input_data is not None else None,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE
         )
-        output, error = p.communicate()
+        output, error = p.communicate(input_data)
         if p.returncode:
             self.logger.debug('StdErr Output:')
             for line in error.decode('utf-8').strip().split('\n'):
@@ -71,6 +74,65 @@ class ZabbixSender(object):
 
         return '%s: %s' % (name, value)
 
+    def send_items(self, items: List[Tuple[str, str]]) -> str:
+        try:
+            self._parse_output(self._send_tcp(items))
+        except OSError as e:
+            self.logger.warning(F'Native sender protocol failed ({e!r}), falling back to {self.sender_path}.')
+            lines = []
+            for name, value in items:
+                escaped_value = ('%s' % value).replace('\\', '\\\\').replace('"', '\\"')
+                lines.append(F'- {name} "{escaped_value}"')
+            payload = '\n'.join(lines) + '\n'
+            self._parse_output(self._execute_sender(['-i', '-'], input_data=payload.encode('utf-8')))
+
+        return '\n'.join('%s: %s' % (name, value) for name, value in items)
+
+    def _read_config(self) -> Tuple[str, int, str]:
+        server, port, hostname = '127.0.0.1', 10051, None
+        with open(self.config_path) as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith('ServerActive='):
+                    server = line.split('=', 1)[1].split(',')[0].strip()
+                    if ':' in server:
+                        server, port = server.rsplit(':', 1)
+                        port = int(port)
+                elif line.startswith('Hostname='):
+                    hostname = line.split('=', 1)[1].strip()
+
+        return server, port, hostname or socket.gethostname()
+
+    def _send_tcp(self, items: List[Tuple[str, str]]) -> str:
+        server, port, hostname = self._read_config()
+        self.last_command = F'sender protocol to {server}:{port}'
+        payload = orjson.dumps({
+            'request': 'sender data',
+            'data': [{'host': hostname, 'key': name, 'value': '%s' % value} for name, value in items],
+        })
+        with socket.create_connection((server, port), timeout=10) as connection:
+            connection.sendall(b'ZBXD\x01' + struct.pack('<Q', len(payload)) + payload)
+            header = self._receive_exactly(connection, 13)
+            if header[:5] != b'ZBXD\x01':
+                raise ZabbixSenderException('Unexpected protocol header: %r' % header[:5])
+            response_length = struct.unpack('<Q', header[5:])[0]
+            response = orjson.loads(self._receive_exactly(connection, response_length))
+        if response.get('response') != 'success':
+            raise ZabbixSenderException('Zabbix server responded: %r' % response)
+
+        return response['info']
+
+    @staticmethod
+    def _receive_exactly(connection: socket.socket, count: int) -> bytes:
+        data = b''
+        while len(data) < count:
+            chunk = connection.recv(count - len(data))
+            if not chunk:
+                raise ZabbixSenderException('Connection closed while reading response')
+            data += chunk
+
+        return data
+
 
 def main():
     logging.basicConfig(level=logging.DEBUG)
@@ -84,15 +146,16 @@ def main():
     discovery = []
     for software_name in sorted(response_data.keys()):
         discovery.append({'{#SOFTWARENAME}': software_name})
-    print(sender.send_item('software_versions.discovery', json.dumps({'data': discovery})))
+    items = [('software_versions.discovery', orjson.dumps({'data': discovery}).decode('utf-8'))]
     logger.info(F'Discovered {len(discovery)} software names.')
 
     for software_name, current_version in response_data.items():
-        try:
-            print(sender.send_item(F'software_versions.most_recent_version[{software_name}]', current_version))
-        except ZabbixSenderException as e:
-            logger.exception(e)
-            logger.error('Cannot send item, maybe a new software was discovered, just re-run the script in a minute.')
+        items.append((F'software_versions.most_recent_version[{software_name}]', current_version))
+    try:
+        print(sender.send_items(items))
+    except ZabbixSenderException as e:
+        logger.exception(e)
+        logger.error('Cannot send items, maybe a new software was discovered, just re-run the script in a minute.')
 
 
 if __name__ == '__main__':